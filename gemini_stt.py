@@ -3,38 +3,296 @@
 Gemini API를 이용한 음성 녹음 및 텍스트 변환 (STT) - Google GenAI SDK 버전
 """
 
+import hashlib
+import io
+import itertools
+import json
 import os
-import wave
+import struct
+import sys
+import tempfile
+import threading
 import time
-import pyaudio
+import wave
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+
 from dotenv import load_dotenv
-from google import genai
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# numpy / sounddevice / soundfile / google-genai는 무거우므로 실제로 쓰는 시점에 import
 
 load_dotenv()
 
+# 오디오 설정 (16 kHz mono int16)
+RATE = 16000
+CHANNELS = 1
+SAMPLE_WIDTH = 2
+
+PROMPT = (
+    "이 오디오 파일의 음성을 가능한 한 정확하게 텍스트로 변환해줘. "
+    "한국어/영어 모두 지원. "
+    "추가 설명 없이 변환된 텍스트만 출력해."
+)
+SEGMENTS_PROMPT = PROMPT + " 여러 오디오 파일은 하나의 녹음을 순서대로 나눈 것이니 이어서 변환해."
+
+# 일괄 변환 시 녹음(및 결과) 사이 구분자
+BATCH_SEP = "---NEXT---"
+BATCH_PROMPT = (
+    f"여러 개의 녹음이 각각 '{BATCH_SEP}' 표시 뒤에 순서대로 주어진다. "
+    "각 녹음의 음성을 가능한 한 정확하게 텍스트로 변환해줘. "
+    "한국어/영어 모두 지원. "
+    "한 녹음이 여러 오디오 파일로 나뉘어 있으면 이어서 변환해. "
+    f"추가 설명 없이 변환된 텍스트만, 녹음 순서대로 '{BATCH_SEP}' 줄로 구분해 출력해."
+)
+
+# 프롬프트 문구가 바뀌면 변환 캐시도 무효화되도록 캐시 키에 섞는 값
+_PROMPT_DIGEST = hashlib.blake2b(
+    "\0".join([PROMPT, SEGMENTS_PROMPT, BATCH_PROMPT]).encode(), digest_size=16
+).digest()
+
+# 업로드 포맷별 mime_type
+MIME_TYPES = {"opus": "audio/ogg", "flac": "audio/flac", "wav": "audio/wav"}
+# soundfile로 인코딩하는 포맷의 (format, subtype)
+SF_FORMATS = {"opus": ("OGG", "OPUS"), "flac": ("FLAC", "PCM_16")}
+
+# API 키별 genai.Client 공유: 인스턴스를 새로 만들어도 기존 HTTP 연결 풀을 재사용
+_client_cache = {}
+_client_lock = threading.Lock()
+
+# 저장 파일명: 실행 시작 시각 + pid + 모든 인스턴스가 공유하는 카운터
+_RUN_STAMP = time.strftime("%Y%m%d_%H%M%S")
+_rec_counter = itertools.count()
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "fc_test")
+MODEL_CACHE_FILE = os.path.join(CACHE_DIR, "gemini_model.json")
+MODEL_CACHE_TTL = 24 * 60 * 60
+STT_CACHE_DIR = os.path.join(CACHE_DIR, "stt")
+STT_MEM_CACHE_SIZE = 128
+
+# 앞뒤 무음 제거: 20 ms 프레임의 RMS(int16 기준)가 임계값 이하면 무음
+SILENCE_RMS = 200
+SILENCE_FRAME_SEC = 0.02
+SILENCE_PAD_SEC = 0.2
+
+# 녹음 중 업로드를 겹치기 위한 세그먼트 길이 (초)
+SEG_SEC = 2
+
+# 실시간 업로드 시 한 번에 보내는 단위. Files API의 resumable 업로드는
+# 마지막 청크가 아니면 256 KiB 배수여야 함
+LIVE_CHUNK = 256 * 1024
+
+# 녹음 진행 표시 간격 (초)
+PROGRESS_SEC = 0.2
+
+# 업로드 파일이 ACTIVE가 될 때까지 기다리는 최대 시간 (초)
+ACTIVE_WAIT_SEC = 5
+
+
+class LivePCMFile(io.RawIOBase):
+    """
+    녹음 중인 PCM 버퍼를 WAV 파일처럼 읽는 객체. 아직 녹음되지 않은 구간은 read()가 기다림.
+    전체 크기는 미리 알 수 있으므로 헤더에 실제 길이를 쓰고 seek/tell도 지원 (SDK가 크기 계산에 사용).
+    """
+
+    def __init__(self, header: bytes, pcm: memoryview):
+        self._header = header
+        self._pcm = pcm
+        self._size = len(header) + len(pcm)
+        self._pos = 0
+        self._avail = len(header)
+        self._done = False
+        self._cond = threading.Condition()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self._size}[whence]
+        self._pos = max(0, base + pos)
+        return self._pos
+
+    def commit(self, n: int):
+        # PortAudio 콜백에서 호출: PCM 앞쪽 n바이트가 채워졌음을 알림
+        with self._cond:
+            self._avail = len(self._header) + n
+            self._cond.notify_all()
+
+    def finish(self, n: int):
+        # 녹음 종료. 예정보다 일찍 끝났으면 헤더 길이와 맞도록 나머지는 무음으로 채움
+        self._pcm[n:] = bytes(len(self._pcm) - n)
+        with self._cond:
+            self._avail = self._size
+            self._done = True
+            self._cond.notify_all()
+
+    def read(self, n=-1) -> bytes:
+        if n is None or n < 0:
+            n = self._size
+        with self._cond:
+            # 끝나기 전에는 LIVE_CHUNK 단위로만 내보냄
+            while not self._done and self._avail - self._pos < min(n, LIVE_CHUNK):
+                self._cond.wait()
+            end = min(self._pos + n, self._avail)
+            if not self._done:
+                end = self._pos + (end - self._pos) // LIVE_CHUNK * LIVE_CHUNK
+
+        # [pos, end)는 이미 기록이 끝난 구간이라 잠금 없이 복사
+        hdr = len(self._header)
+        out = bytearray()
+        if self._pos < hdr:
+            out += self._header[self._pos:min(end, hdr)]
+        if end > hdr:
+            out += self._pcm[max(self._pos, hdr) - hdr:end - hdr]
+        self._pos = max(self._pos, end)
+        return bytes(out)
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+
+@lru_cache(maxsize=None)
+def _load_soundfile():
+    # 선택 의존성: libsndfile이 없으면 None (import 시도는 한 번만)
+    try:
+        import soundfile
+    except (ImportError, OSError):
+        return None
+    return soundfile
+
+
+class BufferPool:
+    """
+    길이별로 bytearray를 재사용하는 풀. 반복 녹음 시 수 MB 버퍼를 매번 새로 할당하지 않음.
+    """
+
+    def __init__(self):
+        self.free = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, n: int) -> bytearray:
+        with self._lock:
+            bufs = self.free.get(n)
+            if bufs:
+                return bufs.pop()
+        return bytearray(n)
+
+    def release(self, buf: bytearray):
+        with self._lock:
+            self.free.setdefault(len(buf), []).append(buf)
+
 
 class GeminiSTT:
-    def __init__(self, api_key=None, model_name=None):
+    def __init__(self, api_key=None, model_name=None, upload_format="opus"):
         self.api_key = api_key or os.getenv("GEMINI_API_KEY")
         if not self.api_key:
             raise ValueError("GEMINI_API_KEY가 설정되지 않았습니다. .env 파일을 확인하세요.")
 
-        # Google GenAI SDK Client
-        self.client = genai.Client(api_key=self.api_key)  # :contentReference[oaicite:5]{index=5}
+        # Google GenAI SDK Client (gRPC/protobuf까지 끌어오므로 모듈 로드 시가 아닌 여기서 import)
+        from google import genai as _genai
+
+        with _client_lock:
+            if self.api_key not in _client_cache:
+                _client_cache[self.api_key] = _genai.Client(api_key=self.api_key)  # :contentReference[oaicite:5]{index=5}
+            self.client = _client_cache[self.api_key]
 
         # 모델 선택: 가능한 모델 목록에서 우선순위로 고름
         self.model = model_name or self._pick_model()
 
         # 오디오 설정
-        self.chunk = 1024
-        self.format = pyaudio.paInt16
-        self.channels = 1
-        self.rate = 16000
-        self.audio = pyaudio.PyAudio()
+        # STT는 캡처 쪽 실시간성이 필요 없으니 큰 블록(256 ms)으로 콜백 횟수를 줄임
+        self.chunk = 4096
+        self.dtype = "int16"
+        self.sample_width = SAMPLE_WIDTH
+        self.channels = CHANNELS
+        self.rate = RATE
+
+        # 업로드 포맷: "opus"(Ogg/Opus, 기본), "flac"(무손실 압축) 또는 "wav"(무압축 PCM)
+        self.upload_format = upload_format
+        # 업로드/저장 전에 앞뒤 무음 구간을 잘라냄
+        self.trim_silence = True
+        # True면 세그먼트 대신 녹음 시작과 동시에 WAV 하나를 스트리밍 업로드 (압축/무음 건너뛰기 없음)
+        self.live_upload = False
+
+        # 업로드/삭제는 I/O 대기라 스레드로 충분
+        self._executor = ThreadPoolExecutor(max_workers=4)
+        # 서버 파일 삭제는 결과를 기다릴 필요가 없으니 별도 풀에서 백그라운드로
+        self._cleanup_exec = ThreadPoolExecutor(max_workers=2)
+        # 녹음 버퍼 재사용 (record_and_transcribe가 업로드 후 반납)
+        self.pool = BufferPool()
+
+        # 일괄 변환 대기열: (Future, 오디오 해시, 업로드 파일들)
+        self.pending = []
+
+        # 오디오 해시 -> 변환 텍스트 (메모리 LRU, 디스크 캐시 앞단)
+        self._text_cache = OrderedDict()
 
     def _pick_model(self) -> str:
+        """
+        선택된 모델을 API 키별로 디스크에 캐시(TTL 24시간)해 매번 models.list() 왕복을 피함.
+        """
+        key = hashlib.sha256(self.api_key.encode()).hexdigest()[:16]
+
+        entry = self._read_model_cache().get(key)
+        if entry and time.time() - entry.get("ts", 0) < MODEL_CACHE_TTL:
+            return entry["model"]
+
+        model = self._list_and_pick_model()
+        if model is not None:
+            self._write_model_cache(key, model)
+            return model
+
+        # list가 막히면, 일단 가장 보편적인 모델로 시도 (캐시하지 않음)
+        return "gemini-2.0-flash"
+
+    @staticmethod
+    def _read_model_cache() -> dict:
+        try:
+            with open(MODEL_CACHE_FILE, "r", encoding="utf-8") as f:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_SH)
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _write_model_cache(key: str, model: str):
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            with open(MODEL_CACHE_FILE, "a+", encoding="utf-8") as f:
+                # 동시에 여러 프로세스가 써도 다른 키의 항목을 잃지 않도록 잠근 채 읽고-쓰기
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                f.seek(0)
+                try:
+                    cache = json.load(f)
+                except ValueError:
+                    cache = {}
+                cache[key] = {"model": model, "ts": time.time()}
+                f.seek(0)
+                f.truncate()
+                json.dump(cache, f)
+        except OSError:
+            # 캐시는 최적화일 뿐이므로 실패해도 무시
+            pass
+
+    def _list_and_pick_model(self):
         """
         계정/키에 따라 사용 가능 모델이 다를 수 있으니, 실제 list() 결과 기반으로 선택.
+        list() 호출 자체가 실패하면 None.
         """
         preferred = [
             "gemini-2.5-flash",
@@ -53,8 +311,7 @@ class GeminiSTT:
                 if short:
                     available.append(short)
         except Exception:
-            # list가 막히면, 일단 가장 보편적인 모델로 시도
-            return "gemini-2.0-flash"
+            return None
 
         for p in preferred:
             if p in available:
@@ -67,90 +324,448 @@ class GeminiSTT:
             "→ 위 목록 중 하나를 model_name으로 지정하세요."
         )
 
-    def record_audio(self, duration=5, output_file="recorded_audio.wav"):
-        print(f"\n🎤 녹음을 시작합니다... ({duration}초)")
+    def _pcm_bytes(self, duration) -> int:
+        # duration초 녹음에 필요한 PCM 버퍼 크기
+        return int(self.rate * self.channels * self.sample_width * duration)
 
-        stream = self.audio.open(
-            format=self.format,
-            channels=self.channels,
-            rate=self.rate,
-            input=True,
-            frames_per_buffer=self.chunk,
-        )
+    def record_audio(self, duration=5, output_file=None, on_segment=None, on_live=None, buf=None):
+        """
+        녹음 후 (output_file 또는 None, PCM memoryview) 반환. output_file이 있을 때만 디스크에 기록.
+        on_segment가 주어지면 SEG_SEC 분량이 찰 때마다 해당 PCM 구간(memoryview)으로 호출.
+        on_live가 주어지면 녹음 시작 직전에 녹음과 함께 채워지는 LivePCMFile로 한 번 호출.
+        buf를 주면 풀에서 새로 빌리지 않고 그 버퍼(크기 _pcm_bytes(duration))에 녹음.
+        """
+        import sounddevice as sd
 
-        frames = []
-        for i in range(0, int(self.rate / self.chunk * duration)):
-            data = stream.read(self.chunk, exception_on_overflow=False)
-            frames.append(data)
+        print(f"\n🎤 녹음을 시작합니다... ({duration}초)")
 
-            elapsed = (i + 1) * self.chunk / self.rate
-            print(f"\r녹음 중... {elapsed:.1f}/{duration}초", end="")
+        bytes_per_sec = self.rate * self.channels * self.sample_width
+        total = self._pcm_bytes(duration)
+        mv = memoryview(buf if buf is not None else self.pool.acquire(total))
+        offset = 0
+        seg_bytes = int(bytes_per_sec * SEG_SEC)
+        seg_start = 0
+        live = LivePCMFile(self._wav_header(total), mv) if on_live else None
+
+        def callback(indata, frames, time_info, status):
+            # PortAudio 스레드에서 호출됨: 미리 할당한 버퍼에 바로 복사
+            nonlocal offset
+            n = min(len(indata), total - offset)
+            mv[offset:offset + n] = indata[:n]
+            offset += n
+            if live:
+                live.commit(offset)
+            if offset >= total:
+                raise sd.CallbackStop
+
+        if live:
+            on_live(live)
+
+        # 마지막 블록은 콜백에서 남은 크기만큼만 복사하므로 샘플 수가 정확히 맞음
+        try:
+            with sd.RawInputStream(
+                samplerate=self.rate,
+                channels=self.channels,
+                dtype=self.dtype,
+                blocksize=self.chunk,
+                latency="low",
+                callback=callback,
+            ) as stream:
+                last_print = 0.0
+                while stream.active and offset < total:
+                    sd.sleep(50)
+                    # 표시는 PROGRESS_SEC마다만 (캡처는 PortAudio 스레드라 영향 없음)
+                    now = time.monotonic()
+                    if now - last_print >= PROGRESS_SEC:
+                        last_print = now
+                        sys.stdout.write(f"\r녹음 중... {offset / bytes_per_sec:.1f}/{duration}초")
+                        sys.stdout.flush()
+
+                    # 콜백 스레드가 아닌 여기서 세그먼트를 넘겨 PortAudio 스레드를 막지 않음
+                    while on_segment and offset - seg_start >= seg_bytes:
+                        on_segment(mv[seg_start:seg_start + seg_bytes])
+                        seg_start += seg_bytes
+        finally:
+            # 오류로 끝나도 업로드 스레드가 영원히 기다리지 않도록
+            if live:
+                live.finish(offset)
 
+        sys.stdout.write(f"\r녹음 중... {offset / bytes_per_sec:.1f}/{duration}초")
         print("\n✅ 녹음 완료!")
-        stream.stop_stream()
-        stream.close()
 
-        wf = wave.open(output_file, "wb")
-        wf.setnchannels(self.channels)
-        wf.setsampwidth(self.audio.get_sample_size(self.format))
-        wf.setframerate(self.rate)
-        wf.writeframes(b"".join(frames))
-        wf.close()
+        if on_segment and offset > seg_start:
+            on_segment(mv[seg_start:offset])
 
-        return output_file
+        pcm = mv[:offset]
+        if self.trim_silence:
+            pcm = self._trim_silence(pcm)
+        if output_file:
+            self._write_wav(output_file, pcm)
 
-    def transcribe_audio(self, audio_file: str) -> str:
-        print(f"\n🤖 Gemini API로 텍스트 변환 중... (model={self.model})")
+        return output_file, pcm
 
-        # 1) 파일 업로드 (Files API)
-        uploaded = self.client.files.upload(file=audio_file)  # :contentReference[oaicite:6]{index=6}
+    def _trim_silence(self, pcm):
+        """
+        앞뒤 무음 프레임을 제외한 PCM 구간(memoryview). 전부 무음이면 빈 구간.
+        """
+        import numpy as np
 
+        frame = int(self.rate * SILENCE_FRAME_SEC) * self.channels
+        x = np.frombuffer(pcm, dtype=np.int16)
+        n = len(x) // frame
+        if n == 0:
+            return pcm
+
+        frames = x[: n * frame].astype(np.float32).reshape(n, frame)
+        mask = np.sqrt((frames ** 2).mean(axis=1)) > SILENCE_RMS
+        if not mask.any():
+            return pcm[:0]
+
+        # 말 앞뒤가 잘리지 않도록 약간의 여유를 둠
+        pad = int(SILENCE_PAD_SEC / SILENCE_FRAME_SEC)
+        first = max(0, int(np.argmax(mask)) - pad)
+        last = min(n, n - int(np.argmax(mask[::-1])) + pad)
+
+        frame_bytes = frame * x.itemsize
+        end = len(pcm) if last == n else last * frame_bytes
+        return pcm[first * frame_bytes:end]
+
+    def _wav_header(self, n: int) -> bytes:
+        """
+        PCM 데이터 n바이트에 대한 44바이트 RIFF/WAVE 헤더.
+        """
+        block_align = self.channels * self.sample_width
+        return struct.pack(
+            "<4sI4s4sIHHIIHH4sI",
+            b"RIFF", 36 + n, b"WAVE",
+            b"fmt ", 16, 1, self.channels, self.rate, self.rate * block_align, block_align, self.sample_width * 8,
+            b"data", n,
+        )
+
+    @staticmethod
+    def _reserve_audio_file() -> str:
+        """
+        아직 없는 저장 파일명을 골라 빈 파일로 선점 (기존 녹음을 덮어쓰지 않도록 "xb"로 생성).
+        """
+        while True:
+            path = f"rec_{_RUN_STAMP}_{os.getpid()}_{next(_rec_counter)}.wav"
+            try:
+                open(path, "xb").close()
+                return path
+            except FileExistsError:
+                continue
+
+    def _write_wav(self, path, pcm):
+        # wave 모듈 대신 헤더 + PCM을 그대로 기록 (중간 복사 없음)
+        with open(path, "wb") as f:
+            f.write(self._wav_header(len(pcm)))
+            f.write(pcm)
+
+    def _encode_pcm(self, pcm):
+        """
+        업로드할 (파일 객체, mime_type). 16 kHz PCM WAV 대비 Opus는 약 10배,
+        FLAC은 무손실로 약 2배 작음. 인코더를 쓸 수 없으면 WAV로 대체.
+        """
+        buf = io.BytesIO()
+        sf = _load_soundfile() if self.upload_format in SF_FORMATS else None
+        if sf is not None:
+            import numpy as np
+
+            fmt, subtype = SF_FORMATS[self.upload_format]
+            try:
+                sf.write(buf, np.frombuffer(pcm, dtype=np.int16), self.rate, format=fmt, subtype=subtype)
+                buf.seek(0)
+                return buf, MIME_TYPES[self.upload_format]
+            except (RuntimeError, ValueError, TypeError):
+                # 오래된 libsndfile은 Opus 미지원
+                buf = io.BytesIO()
+
+        buf.write(self._wav_header(len(pcm)))
+        buf.write(pcm)
+        buf.seek(0)
+        return buf, MIME_TYPES["wav"]
+
+    def _upload_pcm(self, pcm):
+        # 디스크를 거치지 않고 메모리에서 인코딩해 그대로 업로드
+        buf, mime_type = self._encode_pcm(pcm)
+        return self._wait_active(self.client.files.upload(file=buf, config={"mime_type": mime_type}))
+
+    def _upload_live(self, live):
+        # 워커 스레드에서 녹음과 동시에 진행: read()가 녹음된 만큼씩 내어줌
+        return self._wait_active(self.client.files.upload(file=live, config={"mime_type": MIME_TYPES["wav"]}))
+
+    def _wait_active(self, uploaded):
+        """
+        업로드 파일이 ACTIVE가 될 때까지 50 ms부터 두 배씩(최대 0.5 s) 늘려가며 확인.
+        아직 처리 중인 파일로 generate_content를 부르면 SDK 내부 재시도로 수 초가 더 걸림.
+        """
+        t0 = time.monotonic()
+        delay = 0.05
+        while getattr(uploaded.state, "name", None) == "PROCESSING" and time.monotonic() - t0 < ACTIVE_WAIT_SEC:
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+            uploaded = self.client.files.get(name=uploaded.name)
+
+        if getattr(uploaded.state, "name", None) == "FAILED":
+            raise RuntimeError(f"업로드한 파일 처리에 실패했습니다: {uploaded.name}")
+        return uploaded
+
+    def _generate(self, uploaded_files) -> str:
         try:
-            prompt = (
-                "이 오디오 파일의 음성을 가능한 한 정확하게 텍스트로 변환해줘. "
-                "한국어/영어 모두 지원. "
-                "추가 설명 없이 변환된 텍스트만 출력해."
-            )
+            prompt = SEGMENTS_PROMPT if len(uploaded_files) > 1 else PROMPT
 
-            # 2) generate_content에 [프롬프트, 업로드 파일] 전달
+            # generate_content에 [프롬프트, 업로드 파일...] 전달
             response = self.client.models.generate_content(
                 model=self.model,
-                contents=[prompt, uploaded],
+                contents=[prompt, *uploaded_files],
             )  # :contentReference[oaicite:7]{index=7}
 
             return response.text or ""
 
         finally:
-            # 3) 서버에 올린 파일 삭제
-            self.client.files.delete(name=uploaded.name)  # :contentReference[oaicite:8]{index=8}
+            # 서버에 올린 파일 삭제
+            self._delete_files(uploaded_files)
 
-    def record_and_transcribe(self, duration=5, save_audio=False):
-        timestamp = time.strftime("%Y%m%d_%H%M%S")
-        audio_file = f"recording_{timestamp}.wav"
+    def _delete_files(self, uploaded_files):
+        # 삭제 왕복을 기다리지 않고 바로 반환 (fire-and-forget)
+        for f in uploaded_files:
+            self._cleanup_exec.submit(self._delete_quietly, f.name)
 
-        self.record_audio(duration, audio_file)
-        text = self.transcribe_audio(audio_file)
+    def _delete_quietly(self, name):
+        try:
+            self.client.files.delete(name=name)  # :contentReference[oaicite:8]{index=8}
+        except Exception as e:
+            # 백그라운드 작업이라 호출자에게 전달할 곳이 없음
+            print(f"\n⚠️  업로드 파일 삭제 실패 ({name}): {e}")
 
-        if not save_audio:
-            os.remove(audio_file)
-            print(f"🗑️  임시 파일 삭제됨: {audio_file}")
-        else:
-            print(f"💾 오디오 파일 저장됨: {audio_file}")
+    def _audio_digest(self, audio_file=None, pcm=None) -> str:
+        """
+        변환 캐시 키: 모델/업로드 방식/프롬프트 + PCM 내용의 BLAKE2b-128 해시.
+        WAV가 아닌 파일은 파일 바이트 전체로 계산.
+        """
+        if pcm is None:
+            try:
+                with wave.open(audio_file, "rb") as wf:
+                    pcm = wf.readframes(wf.getnframes())
+            except (wave.Error, EOFError):
+                with open(audio_file, "rb") as f:
+                    pcm = f.read()
+        h = hashlib.blake2b(digest_size=16)
+        # 모델이나 프롬프트가 바뀌면 이전 결과를 재사용하지 않도록 키에 포함
+        h.update(f"{self.model}\0{self.upload_format}\0{self.live_upload}\0".encode())
+        h.update(_PROMPT_DIGEST)
+        h.update(pcm)
+        return h.hexdigest()
+
+    def _cached_transcription(self, digest: str):
+        if digest in self._text_cache:
+            self._text_cache.move_to_end(digest)
+            return self._text_cache[digest]
 
+        try:
+            with open(os.path.join(STT_CACHE_DIR, f"{digest}.txt"), "r", encoding="utf-8") as f:
+                text = f.read()
+        except OSError:
+            return None
+        self._remember_transcription(digest, text)
         return text
 
-    def __del__(self):
+    def _remember_transcription(self, digest: str, text: str):
+        self._text_cache[digest] = text
+        self._text_cache.move_to_end(digest)
+        if len(self._text_cache) > STT_MEM_CACHE_SIZE:
+            self._text_cache.popitem(last=False)
+
+    def _store_transcription(self, digest: str, text: str):
+        # 빈 응답은 일시적 실패일 수 있으니 캐시하지 않음
+        if not text:
+            return
+        self._remember_transcription(digest, text)
         try:
-            self.audio.terminate()
-        except Exception:
+            os.makedirs(STT_CACHE_DIR, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                "w", encoding="utf-8", dir=STT_CACHE_DIR, suffix=".tmp", delete=False
+            ) as f:
+                f.write(text)
+            # 다른 프로세스가 쓰다 만 파일을 읽지 않도록 원자적으로 교체
+            os.replace(f.name, os.path.join(STT_CACHE_DIR, f"{digest}.txt"))
+        except OSError:
             pass
 
+    def _discard_uploads(self, futures, buf=None):
+        # 완료를 기다렸다가 업로드에 성공한 파일만 삭제 (정리 풀 안에서 돌 수 있으니 직접 순차 삭제)
+        for f in futures:
+            if f.exception() is None:
+                self._delete_quietly(f.result().name)
+        # 모든 업로드가 버퍼를 다 읽은 뒤에야 반납
+        if buf is not None:
+            self.pool.release(buf)
+
+    def transcribe_audio(self, audio_file=None, pcm=None) -> str:
+        if pcm is not None and not len(pcm):
+            print("\n🔇 음성이 감지되지 않았습니다.")
+            return ""
+
+        digest = self._audio_digest(audio_file, pcm)
+        cached = self._cached_transcription(digest)
+        if cached is not None:
+            print("\n⚡ 같은 오디오의 이전 변환 결과를 사용합니다.")
+            return cached
+
+        print(f"\n🤖 Gemini API로 텍스트 변환 중... (model={self.model})")
+
+        # 1) 파일 업로드 (Files API): PCM 버퍼가 있으면 메모리에서 바로
+        if pcm is not None:
+            uploaded = self._upload_pcm(pcm)
+        else:
+            uploaded = self._wait_active(self.client.files.upload(file=audio_file))  # :contentReference[oaicite:6]{index=6}
+
+        # 2) 변환 후 3) 서버 파일 삭제
+        text = self._generate([uploaded])
+        self._store_transcription(digest, text)
+        return text
+
+    def record_and_transcribe(self, duration=5, save_audio=False, batch=False):
+        """
+        batch=True면 업로드까지만 하고 대기열에 넣은 뒤 Future를 반환. flush()에서 한 번에 변환.
+        """
+        audio_file = self._reserve_audio_file() if save_audio else None
+
+        # 다음 세그먼트를 녹음하는 동안 이전 세그먼트를 업로드
+        futures = []
+
+        def on_segment(pcm):
+            # 무음뿐인 세그먼트는 올리지 않음
+            if self.trim_silence:
+                pcm = self._trim_silence(pcm)
+            if len(pcm):
+                futures.append(self._executor.submit(self._upload_pcm, pcm))
+
+        def on_live(live):
+            # 녹음 시작(t=0)부터 업로드를 돌려 녹음이 끝날 즈음엔 대부분 올라가 있도록
+            futures.append(self._executor.submit(self._upload_live, live))
+
+        # 버퍼를 여기서 빌려야 녹음 도중 실패해도 업로드 정리 후 반납할 수 있음
+        buf = self.pool.acquire(self._pcm_bytes(duration))
+        try:
+            if self.live_upload:
+                _, pcm = self.record_audio(duration, audio_file, on_live=on_live, buf=buf)
+            else:
+                _, pcm = self.record_audio(duration, audio_file, on_segment=on_segment, buf=buf)
+        except BaseException:
+            # 예외/Ctrl+C로 녹음이 끊겨도 이미 보낸 세그먼트(또는 실시간 업로드)는 서버에서 정리
+            self._cleanup_exec.submit(self._discard_uploads, futures, buf)
+            # 선점해 둔 빈 저장 파일도 남기지 않음
+            if audio_file:
+                try:
+                    os.remove(audio_file)
+                except OSError:
+                    pass
+            raise
+
+        digest = self._audio_digest(pcm=pcm)
+        text = self._cached_transcription(digest)
+        result = None
+        if not futures:
+            print("\n🔇 음성이 감지되지 않았습니다.")
+            text = ""
+            self.pool.release(buf)
+        elif self.trim_silence and not len(pcm):
+            # 실시간 업로드는 무음이어도 이미 올라가고 있으니 세그먼트 모드와 같게 변환 없이 정리
+            print("\n🔇 음성이 감지되지 않았습니다.")
+            text = ""
+            self._cleanup_exec.submit(self._discard_uploads, futures, buf)
+        elif text is not None:
+            print("\n⚡ 같은 오디오의 이전 변환 결과를 사용합니다.")
+            # 이미 올라간 세그먼트 정리와 버퍼 반납은 백그라운드에서
+            self._cleanup_exec.submit(self._discard_uploads, futures, buf)
+        else:
+            try:
+                uploaded_files = [f.result() for f in futures]
+            except BaseException:
+                # 업로드 실패나 대기 중 Ctrl+C: 남은 업로드가 버퍼를 다 읽은 뒤 정리/반납은 백그라운드에서
+                self._cleanup_exec.submit(self._discard_uploads, futures, buf)
+                raise
+            self.pool.release(buf)
+
+            if batch:
+                result = Future()
+                self.pending.append((result, digest, uploaded_files))
+                print(f"\n📥 변환 대기열에 추가됨 ({len(self.pending)}개) - flush()로 한 번에 변환합니다.")
+            else:
+                print(f"\n🤖 Gemini API로 텍스트 변환 중... (model={self.model})")
+                text = self._generate(uploaded_files)
+                self._store_transcription(digest, text)
+
+        if audio_file:
+            print(f"💾 오디오 파일 저장됨: {audio_file}")
+
+        if batch and result is None:
+            result = Future()
+            result.set_result(text)
+        return result if batch else text
+
+    def flush(self):
+        """
+        대기열의 녹음들을 generate_content 한 번으로 변환하고 결과를 각 Future에 전달.
+        """
+        pending, self.pending = self.pending, []
+        if not pending:
+            return []
+
+        print(f"\n🤖 Gemini API로 {len(pending)}개 녹음 일괄 변환 중... (model={self.model})")
+        contents = [BATCH_PROMPT]
+        for _, _, uploaded_files in pending:
+            contents += [BATCH_SEP, *uploaded_files]
+
+        all_files = [f for _, _, uploaded_files in pending for f in uploaded_files]
+        try:
+            response = self.client.models.generate_content(model=self.model, contents=contents)
+            texts = [t.strip() for t in (response.text or "").split(BATCH_SEP)]
+            if len(texts) == len(pending) + 1 and not texts[0]:
+                texts = texts[1:]
+            if len(texts) != len(pending):
+                # 구분이 어긋나면 녹음별로 단일 녹음용 프롬프트로 다시 요청 (파일은 아직 서버에 있음)
+                texts = [
+                    (self.client.models.generate_content(
+                        model=self.model,
+                        contents=[SEGMENTS_PROMPT if len(uploaded_files) > 1 else PROMPT, *uploaded_files],
+                    ).text or "").strip()
+                    for _, _, uploaded_files in pending
+                ]
+        except Exception as e:
+            for future, _, _ in pending:
+                future.set_exception(e)
+            raise
+        finally:
+            self._delete_files(all_files)
+
+        for (future, digest, _), text in zip(pending, texts):
+            self._store_transcription(digest, text)
+            future.set_result(text)
+        return texts
+
+    def close(self):
+        """
+        백그라운드 작업을 마무리하고 스레드 풀을 정리. 공유 Client는 닫지 않음.
+        """
+        # flush되지 않은 일괄 변환 대기열은 취소하고 올린 파일 정리
+        pending, self.pending = self.pending, []
+        for future, _, uploaded_files in pending:
+            future.cancel()
+            self._delete_files(uploaded_files)
+
+        self._executor.shutdown(wait=True)
+        # 남은 삭제 요청은 끝까지 보내고 종료
+        self._cleanup_exec.shutdown(wait=True)
+
 
 def main():
     print("=" * 60)
     print("🎯 Gemini API를 이용한 음성-텍스트 변환 (STT) - google-genai")
     print("=" * 60)
 
+    stt = None
     try:
         stt = GeminiSTT()
 
@@ -201,6 +816,10 @@ def main():
     except Exception as e:
         print(f"\n❌ 예상치 못한 오류 발생: {e}")
 
+    finally:
+        if stt is not None:
+            stt.close()
+
 
 if __name__ == "__main__":
     main()